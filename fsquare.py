@@ -2,21 +2,88 @@
 
 Needs Foursquare client_id and client_secret. Register at their developer website.
 
+The search responses can be cached to a json file (cache_file argument) so that
+re-running the same searches doesn't repeat the API calls.
+
 Dependencies:
 -------------
 * requests - for making server requests.
+* numpy - for handling the search coordinates.
+* concurrent.futures - for making the API calls concurrently.
+* orjson - (optional) for faster decoding of the API responses. Falls back to json.
+* tqdm - (optional) for showing the search progress.
 """
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from warnings import warn
 from typing import List, Tuple
+from urllib.parse import urlencode
+try:
+    from orjson import loads as _loads  # faster json decoding
+except ImportError:
+    from json import loads as _loads
+try:
+    from tqdm import tqdm  # progress bar
+except ImportError:
+    tqdm = None
+
+log = logging.getLogger(__name__)
+
+_SEARCH_URL = 'https://api.foursquare.com/v2/venues/search?'
+_CATEGORIES_URL = 'https://api.foursquare.com/v2/venues/categories?'
+# search type (tp) -> (API query parameter name, search_params key holding its value)
+_SEARCH_TYPES = {'cat': ('categoryId', 'categories'),
+                 'qur': ('query', 'query')}
 
 
 class fsquare():
 
-    def __init__(self, client_id, client_secret):
+    __slots__ = ('client_id', 'client_secret', 'version', 'cache_file', '_cache', '_all_categories', '_session')
+
+    def __init__(self, client_id, client_secret, cache_file=None):
         self.client_id = client_id
         self.client_secret = client_secret
         self.version = '20200121'  # API version to use
+        # successful search responses, keyed by the search parameters (never the credentials).
+        # Stored in cache_file (json) if given, so that re-runs don't repeat the API calls.
+        self.cache_file = cache_file
+        self._cache = {}
+        if cache_file and os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                self._cache = json.load(f)
+        self._all_categories = {}  # the get_all_fsquare_categories responses, keyed by API version
+        # reuse the connections to the API across calls
+        self._session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the HTTP session used for the API calls and saves the response cache."""
+        self._session.close()
+        if self.cache_file:
+            self.save_cache()
+
+    def save_cache(self, cache_file=None):
+        """Saves the cached search responses to cache_file (default: self.cache_file)."""
+        cache_file = cache_file or self.cache_file
+        if not cache_file:
+            raise ValueError("No cache_file given.")
+        with open(cache_file, 'w') as f:
+            json.dump(self._cache, f)
 
     def fsquare_search_settings(self, centre_lat:float, centre_lon:float) -> Tuple:
         """Constructs the search settings for the API call.
@@ -77,24 +144,42 @@ class fsquare():
         --------
         API call response as a json file.
         """
-        if tp == 'cat':
-            a = f'&categoryId={search_params["categories"]}'
-        elif tp == 'qur':
-            a = f'&query={search_params["query"]}'
-        else:
-            raise ValueError(f"tp can be either 'cat' or 'qur'. Got {tp}.")
-        
-        url = ('https://api.foursquare.com/v2/venues/search'
-               f'?client_id={fixed_params["client_id"]}'
-               f'&client_secret={fixed_params["client_secret"]}'
-               f'&ll={search_params["latitude"]},{search_params["longitude"]}'
-               f'&v={fixed_params["version"]}'
-               +a+
-               f'&radius={search_params["radius"]}'
-               f'&limit={search_params["limit"]}')
-        return requests.get(url).json()
-
-    def get_fsquare_data(self, api_params:dict, queries:List[str], tp:str, coords=[[]], verbose=0) -> Tuple:
+        param_name, param_key = self._resolve_search_type(tp)
+        return self._search(fixed_params, param_name, search_params[param_key], search_params['latitude'],
+                            search_params['longitude'], search_params['radius'], search_params['limit'])
+
+    def _search(self, fixed_params:dict, param_name:str, param_value:str, lat:float, lon:float,
+                radius:int, limit:int, rate_limiter=None) -> dict:
+        """Calls the search endpoint (see make_fsquare_api_call) with the search type already resolved.
+
+        rate_limiter (a _RateLimiter) spaces out the calls that are not served from the cache.
+        """
+        search_qs = urlencode({param_name: param_value,
+                               'll': f'{lat},{lon}',
+                               'radius': radius,
+                               'limit': limit})  # percent-encodes queries with spaces, '&', unicode etc.
+
+        # serve repeated searches from the cache. The key leaves out the credentials
+        key = f'v={fixed_params["version"]}&{search_qs}'
+        if key in self._cache:
+            return self._cache[key]
+
+        url = (_SEARCH_URL
+               + urlencode({'client_id': fixed_params['client_id'],
+                            'client_secret': fixed_params['client_secret'],
+                            'v': fixed_params['version']})
+               + '&' + search_qs)
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        response = self._session.get(url, timeout=10)
+        response.raise_for_status()
+        response = _loads(response.content)
+        if response.get('meta', {}).get('code') == 200:
+            self._cache[key] = response  # don't cache errors (e.g. rate limit exceeded)
+        return response
+
+    def get_fsquare_data(self, api_params:dict, queries:List[str], tp:str, coords=[[]], verbose=0,
+                         workers=8, max_rate=None, max_failures=5) -> Tuple:
         """Calls the Foursquare API for the search strings in queries
            and outputs the final (merged) responses.
         
@@ -115,13 +200,25 @@ class fsquare():
         
         coords: List[List] or numpy.ndarray[numpy.ndarray, numpy.ndarray],
                 (Optional. Default=[[]])
-            Centre coordinates as (latitude, longitude) of the area(s)
-            to search.
+            Centre coordinates as (longitude, latitude) of the area(s)
+            to search, i.e. of shape (?, 2). Defaults to the latitude and
+            longitude in api_params['search_params'].
             
         verbose: int, (Optional. Default=0)
-            Sets the verbosity level: 0 for printing out nothing, 1 for printing some
-            useful messages to track progress and 2 for printing more info (likely to
-            print a lot of messages!).
+            Sets the verbosity level: 0 for printing out nothing, 1 or 2 for showing
+            the progress and printing some useful messages. The details of each API
+            call are logged by the 'fsquare' logger at the DEBUG level.
+
+        workers: int, (Optional. Default=8)
+            The maximum number of API calls to have in flight at the same time.
+            Set to 1 to make the calls one after the other.
+
+        max_rate: float, (Optional. Default=None)
+            The maximum number of API calls to make per second, to stay within the
+            API rate limits. None for no limit.
+
+        max_failures: int, (Optional. Default=5)
+            Stop making API calls after this many consecutive calls failed.
             
         Returns:
         --------
@@ -129,47 +226,82 @@ class fsquare():
             The merged responses from the API calls. It stores all the venues and the
             unique id string of each venue.
         """
+        sp, fp = api_params['search_params'], api_params['fixed_search_params']
+        param_name, _ = self._resolve_search_type(tp)
+
         # check coords input
-        if type(coords)==list:
-            if (len(coords) == 1) & (len(coords[0]) == 0):
-                coords = [[api_params['search_params']['latitude'], api_params['search_params']['longitude']]]
-            number_of_areas_to_search = len(coords)
-        else:
-            if sum(coords[0].shape) != 2:
-                raise ValueError(f'coords must be of shape (?, 2). Got {coords.shape}.')
-            number_of_areas_to_search = coords.shape[0]
-
-        all_fsq_data = {'venues': [], 'venue_ids': []}  # to be populated by the API responses
-        for i, longlat in enumerate(coords):  # search within each specified area
-            api_params['search_params']['longitude'] = longlat[0]
-            api_params['search_params']['latitude'] = longlat[1]
+        coords = np.asarray(coords, dtype=np.float64)
+        if coords.size == 0:
+            # search around the centre set in the search parameters
+            coords = np.array([[sp['longitude'], sp['latitude']]])
+        if coords.shape[-1] != 2:
+            raise ValueError(f'coords must be of shape (?, 2). Got {coords.shape}.')
+        coords = coords.reshape(-1, 2)
+        # don't search the same area twice (keeps the order of the first occurrences)
+        _, first_idx = np.unique(coords, axis=0, return_index=True)
+        if len(first_idx) < coords.shape[0]:
+            if verbose:
+                print(f'Skipping {coords.shape[0] - len(first_idx)} duplicate search areas.\n')
+            coords = coords[np.sort(first_idx)]
+        number_of_areas_to_search = coords.shape[0]
+
+        # build the search parameters of every (area, query) API call up front
+        jobs = []
+        for i in range(number_of_areas_to_search):  # search within each specified area
+            lon, lat = float(coords[i, 0]), float(coords[i, 1])
             for item in queries:  # search for each query
-                if tp == 'cat':
-                    api_params['search_params']['categories'] = item
-                elif tp == 'qur':
-                    api_params['search_params']['query'] = item
-                try:
-                    response = self.make_fsquare_api_call(api_params['search_params'], api_params['fixed_search_params'], tp=tp)
+                jobs.append((i, (fp, param_name, item, lat, lon, sp['radius'], sp['limit'])))
+
+        merged = {}  # venue id -> venue, in the order the venues were first found
+        # progress bar over the search areas (falls back to a message every 10 areas without tqdm)
+        progress = tqdm(total=number_of_areas_to_search, disable=not verbose) if tqdm else None
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # the calls are network bound so keep several of them in flight
+            rate_limiter = _RateLimiter(max_rate) if max_rate else None
+            futures = [(i, executor.submit(self._search, *args, rate_limiter=rate_limiter)) for i, args in jobs]
+            # process the responses in the order the calls were made
+            failures = 0  # consecutive failed calls
+            try:
+                for n, (i, future) in enumerate(futures):
+                    try:
+                        response = future.result()
+                        code = response['meta']['code']
+                        venues = response['response']['venues']
+                    except requests.HTTPError as e:
+                        code, venues = e.response.status_code, []
+                    except (requests.RequestException, ValueError, KeyError) as e:  # ValueError: invalid json
+                        code, venues = None, []
+                        warn(f"API call failed: {repr(e)}")
+
                     # display some useful warnings
-                    exit_func = self._check_response_code(response['meta']['code'])
-                    if exit_func:
-                        return all_fsq_data, venue_ids
-                    
-                    # get the venues
-                    venues = response['response']['venues']
-                except:
-                    venues = []
-                for venue in venues:
-                    # avoid adding duplicates to fsq_data
-                    if venue['id'] not in all_fsq_data['venue_ids']:
-                        all_fsq_data['venues'].append(venue)
-                        all_fsq_data['venue_ids'].append(venue['id'])
-                        if verbose==2:
-                            print(f'Added 1 venue (total={len(venue_ids)})\n')
-            if verbose & (((i+1) % 10)==0):
-                print(f'Finished searching area {i+1} of {number_of_areas_to_search}\n')
+                    if code is not None:
+                        exit_func = self._check_response_code(code)
+                        if exit_func:
+                            return self._as_fsq_data(merged)
+
+                    # stop making calls that are bound to fail (e.g. network down, server outage)
+                    failures = failures + 1 if code != 200 else 0
+                    if failures == max_failures:
+                        warn(f"{max_failures} consecutive API calls failed. Function returned.")
+                        break
+
+                    self._merge_venues(merged, venues)
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug('Got %d venues from API call %d of %d', len(venues), n+1, len(futures))
+                    if (n+1) % len(queries) == 0:  # finished searching area i
+                        if progress is not None:
+                            progress.update(1)
+                        elif verbose and (i+1) % 10 == 0:
+                            print(f'Finished searching area {i+1} of {number_of_areas_to_search}\n')
+            finally:
+                # don't wait for the calls not yet made when leaving early (e.g. KeyboardInterrupt or an error)
+                executor.shutdown(wait=False, cancel_futures=True)
+                if progress is not None:
+                    progress.close()
+        all_fsq_data = self._as_fsq_data(merged)
         if verbose:
-            print(f'Finished processing {number_of_areas_to_search} areas. Found {len(venue_ids)} venues!')
+            print(f'Finished processing {number_of_areas_to_search} areas. '
+                  f'Found {len(all_fsq_data["venue_ids"])} venues!')
             
         return all_fsq_data
 
@@ -201,15 +333,29 @@ class fsquare():
         * Look at https://developer.foursquare.com/docs/resources/categories
           for the category names and identity numbers.
         """
-        url = ('https://api.foursquare.com/v2/venues/categories'
-               f'?client_id={fixed_api_params["client_id"]}'
-               f'&client_secret={fixed_api_params["client_secret"]}'
-               f'&v={fixed_api_params["version"]}')
-        all_categories = requests.get(url).json()
-
-        exit_func = self._check_response_code(all_categories['meta']['code'])
-        if exit_func:
-            return None
+        # the category tree rarely changes so it is fetched once per API version
+        all_categories = self._all_categories.get(fixed_api_params['version'])
+        if all_categories is None:
+            url = _CATEGORIES_URL + urlencode({'client_id': fixed_api_params['client_id'],
+                                               'client_secret': fixed_api_params['client_secret'],
+                                               'v': fixed_api_params['version']})
+            try:
+                response = self._session.get(url, timeout=10)
+                response.raise_for_status()
+                all_categories = _loads(response.content)
+                code = all_categories['meta']['code']
+            except requests.HTTPError as e:
+                self._check_response_code(e.response.status_code)
+                return None
+            except (requests.RequestException, ValueError, KeyError) as e:  # ValueError: invalid json
+                warn(f"API call failed: {repr(e)}")
+                return None
+
+            exit_func = self._check_response_code(code)
+            if exit_func:
+                return None
+            if code == 200:
+                self._all_categories[fixed_api_params['version']] = all_categories
 
         valid_main_category_names = [item['name'] for item in all_categories['response']['categories']]
         if categ_name not in valid_main_category_names:
@@ -225,7 +371,7 @@ class fsquare():
         return all_categories, w_categories
 
     def _find_str_recur(self, out:list, d:dict, w:str) -> list:
-        """Finds w in d recursively and appends the result to out.
+        """Finds w in the nested categories of d and appends the result to out.
 
         Arguments:
         ----------
@@ -246,25 +392,70 @@ class fsquare():
         out: list,
             The input list appended with new entries if conditions are met.
         """
-        if len(d['categories']) != 0:
-            for item in d['categories']:
-                if w.lower() in item['name'].lower():
-                    out.append(item['id'])
-                    self._find_str_recur(out, item, w)
-        else:
-            pass
+        # depth first traversal with an explicit stack of iterators (same order as recursing).
+        # Only the categories that have w in their name are searched further
+        w = w.lower()
+        stack = [iter(d['categories'])]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+            elif w in item['name'].lower():
+                out.append(item['id'])
+                stack.append(iter(item['categories']))
         return out
 
+    @staticmethod
+    def _resolve_search_type(tp:str) -> Tuple[str, str]:
+        """Returns the API query parameter name and the search_params key for the search type tp."""
+        try:
+            return _SEARCH_TYPES[tp]
+        except KeyError:
+            raise ValueError(f"tp can be either 'cat' or 'qur'. Got {tp}.") from None
+
+    @staticmethod
+    def _merge_venues(merged:dict, venues:list):
+        """Adds the venues of an API response to merged (venue id -> venue).
+
+        Duplicate venues (same id) are dropped, keeping the first one found.
+        """
+        for venue in venues:
+            merged.setdefault(venue['id'], venue)
+
+    @staticmethod
+    def _as_fsq_data(merged:dict) -> dict:
+        """Returns the merged venues in the get_fsquare_data output format."""
+        return {'venues': list(merged.values()), 'venue_ids': list(merged)}
+
     @staticmethod
     def _check_response_code(code:int) -> bool:
-        """Returns a warning given the API status code."""
+        """Returns a warning given the API status code (none for 200)."""
         exit_func = False
-        if code == 429:
+        if code == 200:
+            pass
+        elif code == 429:
             warn("API regural calls limit exceeded. Function returned.")
             exit_func = True
         elif code == 500:  # server error
-            warn(f"Server error. Response output: {reponse}")
+            warn(f"Server error. API response status code: {code}")
         else:
             warn(f"API response status code: {code}")
         return exit_func
 
+
+class _RateLimiter():
+    """Spaces out calls (from any thread) to at most max_rate calls per second."""
+
+    def __init__(self, max_rate:float):
+        self._interval = 1 / max_rate
+        self._next_call = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the next call is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_call - now
+            self._next_call = max(self._next_call, now) + self._interval
+        if wait > 0:
+            time.sleep(wait)
@@ -15,48 +15,225 @@ Notes:
 This class module is built primarily to extract data from Berlin restaurant pages.
 Minor changes might need to be made in order to work for other cities as well. The
 code is commented to help the developer make these changes. In addition, the warnings
-and the helpful messages printed out will also make it easy to spot what needs to be changed.
+and the helpful messages logged (logger 'tascraper', enable the INFO level to see the progress)
+will also make it easy to spot what needs to be changed.
 
 Dependencies:
 -------------
 * bs4 - BeautifulSoup, a library to parse HTML documents and navigate the element tree
+* soupsieve - the CSS selector library of bs4 (installed with it), to compile the selectors once
+* lxml - (optional) fast HTML parser for BeautifulSoup. Falls back to html.parser
+* brotli - (optional) to accept brotli compressed pages. Falls back to gzip
 * requests - to make HTTP requests from code
-* re - Regex library, to search for more complex strings
+* requests_cache - (optional) to cache the fetched pages on disk (cache_name argument)
 * selenium - to interact with the web page and uncover hidden data
+* concurrent.futures - to fetch several web pages at the same time
+* orjson - (optional) for faster writing of the data to output_path. Falls back to json
 
 Examples:
 --------
 >>> from tascraper import Scraper
 >>> URL = 'https://www.tripadvisor.com/Restaurants-g187323-Berlin.html'
+>>> with Scraper() as scraper:  # closes the sessions (and the browser, if opened) at the end
+>>>     links = scraper.crawl(url=URL, all_pgs=True)
+>>>     data = scraper.scrape(links, lang='ALL', vb=1)
+
+To process the restaurants as they are scraped:
 >>> scraper = Scraper()
->>> links = scraper.crawl(url=URL, all_pgs=True)
->>> data = scraper.scrape(links, lang='ALL', vb=1)
+>>> for venue_data in scraper.scrape_iter(scraper.crawl(url=URL)):
+>>>     print(venue_data['name'])
+>>> scraper.close()
 
 To get data from a single page:
 >>> URL = 'https://www.tripadvisor.com/Restaurant_Review-g187323-d2047693-Reviews-Ga_Ya_Ya-Berlin.html'
 >>> scraper = Scraper()
 >>> data, sess = scraper.parse_page(scraper.get_soup(URL))
->>> if sess:
->>>     sess.close()
+>>> scraper.close()  # also closes sess (if created)
 """
 
-import requests
+import logging
 import re
-from bs4 import BeautifulSoup
+import requests
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from importlib.util import find_spec
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import soupsieve as sv
+from bs4 import BeautifulSoup, SoupStrainer
 from selenium import webdriver
 from selenium.common.exceptions import SessionNotCreatedException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from warnings import warn
-from typing import List, Tuple  # for type casting
+from urllib.parse import urlsplit
+from typing import Iterable, Iterator, List, Optional, Tuple, Union  # for type casting
+# C based parser, much faster than the pure-Python html.parser
+_PARSER = 'lxml' if find_spec('lxml') is not None else 'html.parser'
+try:
+    from orjson import dumps as _dumps  # faster json encoding (to bytes)
+except ImportError:
+    from json import dumps
+
+    def _dumps(obj) -> bytes:
+        return dumps(obj, ensure_ascii=False).encode('utf-8')
+try:
+    import requests_cache  # on-disk cache of the fetched pages
+except ImportError:
+    requests_cache = None
+# brotli lets urllib3 decode brotli (br) compressed responses
+_ACCEPT_ENCODING = 'br, gzip, deflate' if find_spec('brotli') is not None else 'gzip, deflate'
+
+log = logging.getLogger(__name__)
+
+# the restaurant data to extract (the details add more keys when found)
+_DATA_TO_EXTRACT = ('name', 'address', 'postcode', 'city', 'country', 'price range symbol',
+                    'price range', 'cuisines', 'meals', 'features', 'special diets', 'about',
+                    'rating_Excellent', 'rating_Very good', 'rating_Average', 'rating_Poor',
+                    'rating_Terrible')
+
+# fixed parameters for searching the html - should be the same for all restaurant pages
+# (at least for the same city). The CSS selectors are compiled once instead of on every select call
+
+# the parts of a search page read by _crawler and _get_page_listings (the rest is not parsed)
+_LISTING_STRAINER = SoupStrainer(id=['EATERY_LIST_CONTENTS', 'EATERY_SEARCH_RESULTS'])
+# the restaurant listings (numbered ones have data-test='<number>_list_item')
+_LIST_ITEM_SELECTOR = sv.compile('div._1llCuDZj[data-test$="_list_item"]')
+# the address parts in the businessListingContainer at the top of a restaurant page
+_ADDRESS_SELECTOR = sv.compile('span.street-address, span.extended-address, span.locality, span.country-name')
+_POPULARITY_SELECTOR = sv.compile("span[class='header_popularity popIndexValidation']")
+# the city in the popularity link text (e.g. '#1 of 6,000 Restaurants in Berlin'), same in all web pages
+_POPIDX_RE = re.compile(r'Restaurants in (.+)')
+_PRICE_SELECTOR = sv.compile('.header_links a')
+# the details section of the restaurant page
+_DETAILS_CARD_SELECTOR = sv.compile('div.restaurants-details-card-DetailsCard__innerDiv--1Imq5')
+_ABOUT_SELECTOR = sv.compile('div.restaurants-details-card-DesktopView__desktopAboutText--1VvQH')
+# the titles and values of the details, selected together in one tree walk
+_DETAILS_TITLE_CLASS = 'restaurants-details-card-TagCategories__categoryTitle--28rB6'
+_DETAILS_SELECTOR = sv.compile(f'.{_DETAILS_TITLE_CLASS}, .restaurants-details-card-TagCategories__tagText--Yt3iG')
+# the details pop up window (opened with selenium)
+# (read in the browser by _FIND_DETAILS_JS)
+_HIDDEN_CLASSES = {'container': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__detailsContent--1hucM',
+                   'about': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__desktopAboutText--VY6hs',
+                   'title': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__categoryTitle--2RJP_',
+                   'value': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__tagText--1OH6h',
+                   'loaded': '_1Hzf3Xci'}  # an element of the pop up, present once it has loaded
+_HIDDEN_TIMEOUT = 3000  # milliseconds to wait for the pop up after each click
+# the 'Traveler rating' section
+_RATINGS_SELECTOR = sv.compile("div[class='node-preserve'][data-ajax-preserve='preserved-filters_detail_checkbox_trating_true']")
+_RATING_VALUES_SELECTOR = sv.compile("span[class='row_num is-shown-at-tablet']")
+# clicks every 'View all details' button, waits for the details pop up and returns the text of its about
+# section, details titles and details values (per button), all within a single WebDriver command
+_FIND_DETAILS_JS = """
+var done = arguments[arguments.length - 1];
+var cls = arguments[0];
+var timeout = arguments[1];
+var buttons = Array.prototype.filter.call(document.getElementsByTagName('a'), function (a) {
+    return a.textContent.trim() === 'View all details';
+});
+var out = {buttons: buttons.length, sections: []};
+
+function extract() {
+    var container = document.querySelector('.' + cls.container);
+    var root = container && container.querySelector('div');
+    if (!root || !root.children.length) {
+        return null;
+    }
+    var about = root.children[0].querySelector('div.' + cls.about);
+    var section = root.children[about ? 1 : 0];
+    var details = section && section.querySelector('div');
+    var titles = [], values = [];
+    if (details) {
+        Array.prototype.forEach.call(details.querySelectorAll('.' + cls.title + ', .' + cls.value), function (e) {
+            (e.classList.contains(cls.title) ? titles : values).push(e.textContent);
+        });
+    }
+    return {about: about ? about.textContent : null, titles: titles, values: values};
+}
+
+function click(i) {
+    if (i >= buttons.length) {
+        done(out);
+        return;
+    }
+    buttons[i].click();
+    var start = Date.now();
+    (function wait() {
+        var loaded = document.querySelector('.' + cls.loaded) !== null;
+        if (loaded || Date.now() - start > timeout) {
+            out.sections.push({loaded: loaded, data: extract()});
+            click(i + 1);
+        } else {
+            setTimeout(wait, 100);
+        }
+    })();
+}
+click(0);
+"""
+
+# resources not needed by the selenium fallback (blocked in the browser)
+_BLOCKED_URLS = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.svg', '*.mp4', '*.woff', '*.woff2', '*.ttf',
+                 '*googletagmanager*', '*google-analytics*', '*doubleclick*', '*facebook.net*']
+_USER_AGENT = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 '
+               '(KHTML, like Gecko) Version/14.0 Safari/605.1.15')
 
 
 class Scraper:
 
-    def __init__(self):
+    def __init__(self, cache_name=None, expire_after=86400):
+        """
+        Arguments:
+        ----------
+        cache_name: str, (optional; default=None)
+            Cache the fetched pages on disk under this name (needs requests_cache)
+            so that re-running a crawl or scrape doesn't download the pages again.
+
+        expire_after: int, (optional; default=86400)
+            The seconds after which a cached page is downloaded again, unless the
+            website's cache headers say otherwise. Only used with cache_name.
+        """
         self.base_url = None
         self.domain_name = None
-
-    def crawl(self, url: str, all_pgs=True) -> List[List[str]]:
+        # reuse the connections to the website across page fetches
+        if cache_name:
+            if requests_cache is None:
+                raise ImportError('requests_cache is needed for caching the pages (cache_name).')
+            # also cache the missing pages (404) so they are not requested again on every run, and
+            # let the Cache-Control/ETag headers of the website override expire_after when sent
+            self._session = requests_cache.CachedSession(cache_name, backend='sqlite', expire_after=expire_after,
+                                                         allowable_codes=(200, 404), cache_control=True)
+        else:
+            self._session = requests.Session()
+        self._session.headers.update({'User-Agent': _USER_AGENT, 'Accept-Encoding': _ACCEPT_ENCODING})
+        # also back off when the website rate limits (429, honouring its Retry-After header)
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=32, max_retries=retries))
+        self._driver = None  # selenium web driver session, created when first needed and reused
+        self.failed_links = list()  # the links that could not be fetched or scraped by the last scrape
+        # remember the most recently fetched search pages (e.g. fetched by crawl and again on a re-run).
+        # The restaurant pages are fetched once per scrape and are not kept
+        self._fetch_page = lru_cache(maxsize=128)(self._get_page)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the HTTP session used for fetching the pages and the web driver session (if any)."""
+        self._session.close()
+        if self._driver:
+            self._webdriversession(mode='close', wbdriver=self._driver)
+            self._driver = None
+
+    def clear_cache(self):
+        """Forgets the recently fetched search pages."""
+        self._fetch_page.cache_clear()
+
+    def crawl(self, url: str, all_pgs=True, workers=16) -> List[List[str]]:
         """Get list of restaurants.
 
         Arguments:
@@ -68,37 +245,41 @@ class Scraper:
             Automatically crawl and extract the restaurant listings from subsequent pages.
             Set to False if you only want to get the restaurants found in the input url.
 
+        workers: int, (optional; default=16)
+            The maximum number of search pages to fetch at the same time.
+
         Returns:
         --------
         links: List[List[str]],
             The restaurant web pages to scrape the data from.
         """
         # check input url
-        assert(url.find('http') != -1), "Make sure the input url starts with http:// or https://"
+        parts = urlsplit(url)
+        assert(parts.scheme in ('http', 'https')), "Make sure the input url starts with http:// or https://"
 
-        if url.find('https') != -1:
-            stp = url.find('/', 7)  # avoid the http://
-        else:
-            stp = url.find('/', 8)  # avoid the https://
-        self.domain_name = url[url.rfind('.', 0, stp):stp]
-        self.base_url = url[:stp]
+        self.domain_name = parts.hostname[parts.hostname.rfind('.'):]  # e.g. '.com'
+        self.base_url = f'{parts.scheme}://{parts.netloc}'
 
-        print(f'[crawl] From url {url}')
-        soup = self.get_soup(url)
-        print('[crawl] Retrieving restaurant listings...\n')
+        log.info('[crawl] From url %s', url)
+        soup = self.get_soup(url, parse_only=_LISTING_STRAINER, cached=True)
+        log.info('[crawl] Retrieving restaurant listings...')
         if all_pgs:
-            # get sub-pages with restaurants
-            all_pages = [url] + self._crawler(soup)
-            links = list()
-            for page in all_pages:
-                links.append(self._get_page_listings(self.get_soup(page)))
+            # get sub-pages with restaurants (the first page is already parsed)
+            other_pages = self._crawler(soup)
+            links = [self._get_page_listings(soup)]
+            # fetch the other search pages concurrently (in order)
+            links += [self._get_page_listings(page_soup)
+                      for page_soup in self._fetch_soups(other_pages, workers=workers, parse_only=_LISTING_STRAINER,
+                                                         cached=True)
+                      if page_soup is not None]
         else:
             # get the page listings from a single page
             links = [self._get_page_listings(soup)]
-        print('[crawl] Retrieved all restaurant listings.\n')
+        log.info('[crawl] Retrieved all restaurant listings.')
         return links
 
-    def scrape(self, links: List[List[str]], lang='ALL', vb=0) -> List[dict]:
+    def scrape(self, links: List[List[str]], lang='ALL', vb=0, workers=16,
+               output_path: Optional[str] = None) -> Union[List[dict], str]:
         """Extracts data from each restaurant page in links.
 
         Arguments:
@@ -113,53 +294,112 @@ class Scraper:
             The verbosity level. 0: no verbosity, 1: medium,
             2: high (warning: might print out many messages!).
 
+        workers: int, (optional; default=16)
+            The maximum number of pages to fetch at the same time.
+
+        output_path: str, (optional; default=None)
+            A file to write the restaurant data to as they are scraped, one json
+            object per line (JSON Lines). Use it for large crawls so that the data
+            is not kept in memory and is not lost if the scraping stops midway.
+
         Returns:
         --------
-        data: List[dict],
+        data: List[dict] or str,
             The scraped data returned as a list where each element is a dictionary
-            that contains the individual restaurant data.
+            that contains the individual restaurant data. If output_path is given,
+            output_path is returned instead.
+
+        The links that could not be fetched or scraped are kept in self.failed_links,
+        e.g. to retry them later with scrape([scraper.failed_links]). The pages that
+        could not be scraped are removed from the on-disk cache (cache_name), so a
+        retry downloads them again.
+        """
+        venues = self.scrape_iter(links, lang=lang, vb=vb, workers=workers)
+        if not output_path:
+            return list(venues)
+
+        with open(output_path, 'wb') as out_file:
+            for venue_data in venues:
+                out_file.write(_dumps(venue_data) + b'\n')
+        return output_path
+
+    def scrape_iter(self, links: List[List[str]], lang='ALL', vb=0, workers=16) -> Iterator[dict]:
+        """Extracts data from each restaurant page in links and yields it as soon as it is scraped.
+
+        Arguments:
+        ----------
+        See scrape.
+
+        Yields:
+        -------
+        venue_data: dict,
+            The individual restaurant data (in the order of links).
         """
         # check verbosity level input
         if vb not in [0, 1, 2]:
             warn(f"Valid verbosity levels (vb) are [0, 1, 2]. Got {vb}. Changed to 1")
             vb = 1
 
-        # initialise parameters and output list
+        # initialise parameters
         v_id = 0   # counter for assigning unique venue id
         batch = 0  # to keep track of the number of link batches scraped
         total_batches = len(links)
-        session = None  # for selenium web driver session
-        data = list()   # populate with the individual restaurant data
+        self.failed_links = list()
 
+        # drop the repeated links (search pages can overlap) so each restaurant is fetched and parsed once
+        seen = set()
+        unique_links = list()
+        for search_page in links:
+            unique_links.append(list())
+            for link in search_page:
+                if link not in seen:
+                    seen.add(link)
+                    unique_links[-1].append(link)
+        links = unique_links
+
+        # the unfiltered page already shows reviews in all languages
+        lang_filter = '' if lang == 'ALL' else f'?filterLang={lang}'
+
+        # fetch the pages concurrently (with the language filter applied) but parse them here,
+        # one by one and in order, since the selenium fallback of parse_page is not thread safe
+        soups = self._fetch_soups((link + lang_filter for search_page in links for link in search_page),
+                                  workers=workers)
         for search_page in links:
             batch += 1
             for link in search_page:
                 if vb == 2:
                     print(f"Scraping {link}")
-                # apply the language filter and get the soup
-                soup = self.get_soup(f"{link}?filterLang={lang}")
+                soup = next(soups)
+                if soup is None:
+                    self.failed_links.append(link)
+                    continue  # could not be fetched (logged by _fetch_soups)
 
                 try:
                     # get the venue_data
-                    venue_data, session = self.parse_page(soup, url=link, session=session)
-
-                    # add the url
-                    venue_data['url'] = link
-
-                    # assign a unique id
-                    venue_data['venue_id'] = f'id_{v_id}'
-                    v_id += 1
-
-                    # add it to the data set
-                    data.append(venue_data)
-                except:
-                    print(f'[scrape] Could not scrape {link}\n')
-
-            if (vb == 1) & (len(links) != 0):
+                    # the web driver session (if any) is reused across pages and scrape calls
+                    venue_data, self._driver = self.parse_page(soup, url=link, session=self._driver)
+                except (AttributeError, KeyError, IndexError, ValueError) as e:
+                    # log the error type too, to see which part of the page layout was unexpected
+                    log.warning('[scrape] Could not scrape %s (%r)', link, e)
+                    self.failed_links.append(link)
+                    # a 200 page (error statuses are not parsed, see _get_page), e.g. a bot check
+                    # or partial page, so download it again on a retry
+                    self._uncache_page(link + lang_filter)
+                    continue
+                finally:
+                    # free the page tree now instead of leaving its reference cycles to the garbage collector
+                    soup.decompose()
+                # add the url
+                venue_data['url'] = link
+
+                # assign a unique id
+                venue_data['venue_id'] = f'id_{v_id}'
+                v_id += 1
+
+                yield venue_data
+
+            if vb == 1 and links:
                 print(f'Scraped batch {batch} out of {total_batches} batches.')
-        # close the session
-        self._webdriversession(mode='close', wbdriver=session)
-        return data
 
     def parse_page(self, soup, url='', session=None) -> Tuple:
         """Parses the HTML and scrapes page data.
@@ -184,127 +424,121 @@ class Scraper:
         session: object, (selenium.webdriver when created)
             The web driver session.
         """
-
-        data_to_extract = ['name', 'address', 'postcode', 'city', 'country', 'price range symbol',
-                           'price range', 'cuisines', 'meals', 'features', 'special diets', 'about',
-                           'rating_Excellent', 'rating_Very good', 'rating_Average', 'rating_Poor',
-                           'rating_Terrible']
         # initialise the output
-        venue_data = {item:None for item in data_to_extract}
-
-        # fixed parameters for searching the html
-        search_class_params = {'about_text_class': 'restaurants-details-card-DesktopView__desktopAboutText--1VvQH',
-                               'hidden_details_titles_class': 'restaurants-details-card-TagCategories__categoryTitle--28rB6',
-                               'hidden_details_values_class': 'restaurants-details-card-TagCategories__tagText--Yt3iG'
-                               }
+        venue_data = dict.fromkeys(_DATA_TO_EXTRACT)
 
         # ======== Get the info at the top of the page ========
         top_info = soup.find(id='taplc_resp_rr_top_info_rr_resp_0')
         name = top_info.find(class_='ui_header h1')
-        addr_street = top_info.find('div', class_='businessListingContainer').find('span',
-                                                                                   class_='street-address')
-        addr_extended = top_info.find('div', class_='businessListingContainer').find('span',
-                                                                                     class_='extended-address')
-        country = top_info.find('div', class_='businessListingContainer').find('span', class_='country-name')
+        # get all the address parts in a single pass (first span found per class)
+        address = dict()
+        container = top_info.find('div', class_='businessListingContainer')
+        for span in _ADDRESS_SELECTOR.select(container) if container is not None else []:
+            for c in span['class']:
+                address.setdefault(c, span)
+        addr_street = address.get('street-address')
+        addr_extended = address.get('extended-address')
+        country = address.get('country-name')
 
         # a better option is to save the locality and separate to postcode and city after scraping
         # because the split method used here might not work for other cities (e.g. New York) as the page
         # follows a different structure for the locality element.
         save_as_locality = False  # Change save_as_locality to True to do the above:
-        locality = top_info.find('div', class_='businessListingContainer').find('span', class_='locality')
+        locality = address.get('locality')
         if not save_as_locality:
-            try:
-                city = soup.select("span[class='header_popularity popIndexValidation']")[0].a.text
-                dm = 'Restaurants in '  # should be the same in all web pages
-                city = city[city.find(dm)+len(dm):]
-            except IndexError:
-                city = None
-
-        # check for NoneTypes and get the text for each variable
-        checks, texts = self._check_not_none([name, addr_street, addr_extended, locality, country])
-        name, postcode_city, country = texts[0], texts[3], texts[4]
+            popularity = _POPULARITY_SELECTOR.select_one(soup)
+            city_match = None
+            if popularity is not None and popularity.a is not None:
+                city_match = _POPIDX_RE.search(popularity.a.text)
+            city = city_match.group(1) if city_match else None
+
+        # check for NoneTypes and get the text for each variable (without the surrounding whitespace)
+        name = name.get_text().strip() if name is not None else ''
+        postcode_city = locality.get_text().strip() if locality is not None else ''
+        country = country.get_text().strip() if country is not None else ''
         if not save_as_locality:
-            postcode_city = postcode_city.replace(',', '')
+            postcode_city = postcode_city.replace(',', '').strip()
             if city:
-                postcode = postcode_city.strip().strip(city).strip()
+                postcode = postcode_city.removesuffix(city).strip()
             else:
-                try:
-                    postcode = postcode_city.split()[0:-1].strip()
-                    city = postcode_city.split()[-1].strip()
-                except Exception as e:
-                    print('\t[parse page] Unable to extract city and postcode.')
-                    print(f'\tError details: {repr(e)}.')
-                    print('\tSaving as locality.')
+                # assume '<postcode> <city>' (the city is the last word)
+                postcode_parts = postcode_city.rsplit(maxsplit=1)
+                if len(postcode_parts) == 2:
+                    postcode, city = postcode_parts
+                else:
+                    log.warning('[parse page] Unable to extract city and postcode from %r. Saving as locality.',
+                                postcode_city)
                     postcode = postcode_city  # for manual processing
         else:
             postcode = postcode_city  # for manual processing
             city = None
 
         # concatenate the addresses to get the full address
-        if sum(checks[1:3]) == 2:
-            addr_street = texts[1] + f', {texts[2]}'
+        if addr_street is None:
+            addr_street = ''
+        elif addr_extended is None:
+            addr_street = addr_street.get_text().strip()
         else:
-            addr_street = texts[1]
+            addr_street = f'{addr_street.get_text().strip()}, {addr_extended.get_text().strip()}'
 
         # get the symbol based price range
-        try:
-            price_symbols = soup.select('.header_links a')[0].text
+        price_link = _PRICE_SELECTOR.select_one(soup)
+        if price_link is not None:
+            price_symbols = price_link.text
             venue_data['price range symbol'] = price_symbols if '$' in price_symbols else None
-        except:
-            pass
 
         # populate with the restaurant data
-        venue_data['name'] = name
-        venue_data['address'] = addr_street
-        venue_data['postcode'] = postcode
-        venue_data['city'] = city
-        venue_data['country'] = country
+        # (the keys keep their position from _DATA_TO_EXTRACT)
+        venue_data.update({'name': name, 'address': addr_street, 'postcode': postcode,
+                           'city': city, 'country': country})
 
         # ======== Get the details ========
-        try:
-            items = soup.find('div',
-                              class_='restaurants-details-card-DetailsCard__innerDiv--1Imq5').div.next_sibling.div
-            try:
-                about_text = items.find('div', class_=search_class_params['about_text_class']).text
-                venue_data['about'] = about_text
-            except AttributeError:
-                pass
-
-            details_titles = items.select(f".{search_class_params['hidden_details_titles_class']}")
-            details_values = items.select(f".{search_class_params['hidden_details_values_class']}")
-            for i, item in enumerate(details_titles):
-                venue_data[item.text.lower()] = details_values[i].text
-
-        except AttributeError:
+        items = None
+        details_card = _DETAILS_CARD_SELECTOR.select_one(soup)
+        if details_card is not None and details_card.div is not None:
+            # the next sibling can also be a string (getattr then falls back to None)
+            items = getattr(details_card.div.next_sibling, 'div', None)
+
+        if items is not None:
+            about = _ABOUT_SELECTOR.select_one(items)
+            if about is not None:
+                venue_data['about'] = about.text
+
+            venue_data.update(self._get_details(items))
+        else:
             try:
                 # create a session if it does not already exist
                 if not session:
                     session = self._webdriversession(mode='create', wbdriver=None)
+                    # keep it for later calls (closed by self.close()), also if the parsing below fails
+                    self._driver = session
 
-                # wait until the page opens completely
+                # open the page (the driver gives up after 15 seconds, see _webdriversession), then wait
+                # for the details button only. find_details also waits for the pop up itself
                 session.get(url)
-                session.implicitly_wait(15)  # seconds
+                try:
+                    WebDriverWait(session, 10).until(EC.presence_of_element_located((By.LINK_TEXT, 'View all details')))
+                except TimeoutException:
+                    pass  # logged by find_details when it doesn't find the button
 
                 # interact with the web page to get the data and update the venue_data dictionary
                 venue_data.update(self.find_details(session, url=url))
             except Exception as e:
-                print("[parse page] Could not fetch the details.")
-                print(f'Error details: {repr(e)}\n')
+                log.warning('[parse page] Could not fetch the details of %s (%r)', url, e)
 
         # ======== get the ratings ========
         # find the 'Traveler rating' section
-        b = soup.select("div[class='node-preserve'][data-ajax-preserve='preserved-filters_detail_checkbox_trating_true']")
+        b = _RATINGS_SELECTOR.select_one(soup)
 
         # contents[0] is always the section title (e.g. "Traveler rating")
-        try:
-            label_elems = b[0].contents[1].select('div')[0].select('label')
-            label_elems_values = b[0].contents[1].select('div')[0].select("span[class='row_num is-shown-at-tablet']")
-            for i, item in enumerate(label_elems):
-                # convert to integer and add it to the dictionary
-                venue_data['rating_'+item.text] = int(label_elems_values[i].text.replace(',', '').replace('.', ''))
-        except IndexError:
-            # print('[parse page]: No ratings found')
-            pass
+        ratings = b.contents[1].select_one('div') if b is not None and len(b.contents) > 1 else None
+        if ratings is not None:
+            label_elems = ratings.select('label')
+            label_elems_values = _RATING_VALUES_SELECTOR.select(ratings)
+            # convert to integer and add them to the dictionary
+            venue_data.update({'rating_'+label.text: int(value.text.replace(',', '').replace('.', ''))
+                               for label, value in zip(label_elems, label_elems_values)})
+        # else: no ratings found
         return venue_data, session
 
     def find_details(self, session, url) -> dict:
@@ -323,47 +557,30 @@ class Scraper:
         data: dict(),
             The extracted data from the details section pop up window.
         """
-        # fixed parameters - should be the same for all restaurant pages (at least for the same city)
-        hidden_params = {'hidden_class': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__detailsContent--1hucM',
-                         'hidden_about_class': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__desktopAboutText--VY6hs',
-                         'hidden_details_titles_class': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__categoryTitle--2RJP_',
-                         'hidden_details_values_class': 'restaurants-detail-overview-cards-DetailsSectionOverviewCard__tagText--1OH6h'
-                         }
-
-        details_button = session.find_elements_by_link_text('View all details')
-        if len(details_button) > 1:
-            print("More than one 'View all details' button")
-        elif len(details_button) == 0:
-            print("Didn't find 'View all details' button")
+        # a single round trip to the browser instead of several WebDriver commands per button
+        result = session.execute_async_script(_FIND_DETAILS_JS, _HIDDEN_CLASSES, _HIDDEN_TIMEOUT)
+        if result['buttons'] > 1:
+            log.debug("[find_details] More than one 'View all details' button")
+        elif result['buttons'] == 0:
+            log.warning("[find_details] Didn't find 'View all details' button on %s", url)
 
         data = dict()
-        for button in details_button:
-            session.execute_script('arguments[0].click();', button)  # click the button
-
-            # explicitly wait for 3 seconds
-            try:
-                element = WebDriverWait(session, 3).until(lambda x: x.find_element_by_class_name('_1Hzf3Xci'))
-            except TimeoutException as e:
-                # either the class name is not '_1Hzf3Xci' or the page did not load properly within 3 seconds
-                print(f'\t[find_details] An exception has been thrown: {repr(e)}')
-            # get soup
-            soup = BeautifulSoup(session.page_source, 'html.parser')
+        for section in result['sections']:
+            if not section['loaded']:
+                # either the class name is not '_1Hzf3Xci' or the page did not load properly in time
+                log.warning('[find_details] The details pop up did not load within %d ms on %s',
+                            _HIDDEN_TIMEOUT, url)
+            details = section['data']
+            if details is None:
+                log.warning('[find_details] Could not find the details pop up on %s', url)
+                continue
 
             # get the about section
-            try:
-                about_text = soup.select(f".{hidden_params['hidden_class']}")[0].div.contents[0].find('div', class_= hidden_params['hidden_about_class']).text
-                data['about'] = about_text
-                idx = 1
-            except AttributeError:
-                idx = 0
+            if details['about'] is not None:
+                data['about'] = details['about']
 
             # get the details
-            details_titles = soup.select(f".{hidden_params['hidden_class']}")[0].div.contents[idx].div.select(
-                f".{hidden_params['hidden_details_titles_class']}")
-            details_values = soup.select(f".{hidden_params['hidden_class']}")[0].div.contents[idx].div.select(
-                f".{hidden_params['hidden_details_values_class']}")
-            for i, item in enumerate(details_titles):
-                data[item.text.lower()] = details_values[i].text
+            data.update({title.lower(): value for title, value in zip(details['titles'], details['values'])})
         return data
 
     def _crawler(self, soup) -> List[str]:
@@ -385,30 +602,23 @@ class Scraper:
             warn("[_crawler] Couldn't find class 'pageNum taLnk'. Make sure you passed the correct url.")
             return []
 
-        a = 'data-offset="'  # denotes the list items per page
-        data_offsets = list()
-        for item in results2:
-            s = str(item)
-            dummyvar = s.find(a)
-            data_offsets.append(int(s[dummyvar + len(a): s.find('"', dummyvar + len(a))]))
+        # the data-offset attribute denotes the list items per page
+        data_offsets = [int(item['data-offset']) for item in results2]
 
         # get an example url to extract the url parts to append later
-        b = 'href="'
-        dummyvar = s.find(b)
-        url = s[dummyvar + len(b): s.find('"', dummyvar + len(b))]
+        url = results2[-1]['href']
         url_parts = url.split(f'-oa{data_offsets[-1]}-')
 
         # get the difference between elements
         element_diff = [j - i for i, j in zip(data_offsets[:-1], data_offsets[1:])]
 
         # get mode of data_offsets
-        offset = max(set(element_diff), key=element_diff.count)
+        offset = Counter(element_diff).most_common(1)[0][0]
 
         # use the offset to get all the urls
-        urls = list()
-        for i in range(0, data_offsets[-1], offset):
-            urls.append(self.base_url + url_parts[0] + f'-oa{i + offset}-' + url_parts[1])
-        print('\t[_crawler] Finished crawling.\n')
+        urls = [self.base_url + url_parts[0] + f'-oa{i + offset}-' + url_parts[1]
+                for i in range(0, data_offsets[-1], offset)]
+        log.info('[_crawler] Finished crawling.')
         return urls
 
     def _get_page_listings(self, soup) -> List[str]:
@@ -425,38 +635,90 @@ class Scraper:
             The restaurant web pages to scrape the data from.
         """
         results = soup.find(id='EATERY_SEARCH_RESULTS')
+        if results is None:
+            warn("[_get_page_listings] Couldn't find id 'EATERY_SEARCH_RESULTS'. Make sure you passed the correct url.")
+            return []
 
         # get the restaurant list
         # only the numbered ones (avoid the sponsored listings: 'data-test': 'SL_list_item')
-        restaurant_elems = results.find_all('div',
-                                            {'class': '_1llCuDZj',
-                                             'data-test': re.compile(r"([0-9]+)(_list_item)")})
-        # iterate through all elements
-        links = list()
-        for r in restaurant_elems:
-            page_url = r.find('a', href=True)['href']  # the url to the restaurant page
-            links.append(self.base_url + page_url)
-        return links
+        restaurant_elems = [r for r in _LIST_ITEM_SELECTOR.select(results)
+                            if r['data-test'][:-len('_list_item')].isdigit()]
+        # the url to each restaurant page
+        return [self.base_url + r.find('a', href=True)['href'] for r in restaurant_elems]
 
     @staticmethod
-    def get_soup(url: str):
-        """Returns the bs4.BeautifulSoup object."""
-        page = requests.get(url)
-        return BeautifulSoup(page.content, 'html.parser')
+    def _get_details(tag) -> dict:
+        """Returns the details found in tag as a {title: value} dictionary.
 
-    @staticmethod
-    def _check_not_none(bs4out: list) -> Tuple[list, list]:
-        """Checks for NoneTypes and returns the text for each item."""
-        out = list()
-        text = list()
-        for item in bs4out:
+        _DETAILS_SELECTOR matches both the titles and the values, which are then split
+        by class, so tag is only walked once. A title without a value (or a value
+        without a title) at the end is ignored.
+        """
+        details_titles, details_values = list(), list()
+        for elem in _DETAILS_SELECTOR.select(tag):
+            if _DETAILS_TITLE_CLASS in elem['class']:
+                details_titles.append(elem)
+            else:
+                details_values.append(elem)
+        return {title.text.lower(): value.text for title, value in zip(details_titles, details_values)}
+
+    def _fetch_soups(self, urls: Iterable[str], workers=16, parse_only=None, cached=False) -> Iterator:
+        """Fetches the urls concurrently and yields their bs4.BeautifulSoup objects in order.
+
+        At most 2*workers pages are held in memory ahead of the consumer. parse_only
+        and cached are passed to get_soup. None is yielded for a page that could not be fetched
+        or has an error status (after the retries of the session), so that one failed page
+        doesn't stop the others.
+        """
+        def result(url, future):
             try:
-                text.append(item.text)
-                out.append(True)
-            except AttributeError:
-                out.append(False)
-                text.append([''])
-        return out, text
+                return future.result()
+            except requests.RequestException as e:
+                log.warning('[_fetch_soups] Could not fetch %s (%r)', url, e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for url in urls:
+                pending.append((url, executor.submit(self.get_soup, url, parse_only, cached)))
+                if len(pending) >= 2 * workers:
+                    yield result(*pending.popleft())
+            while pending:
+                yield result(*pending.popleft())
+
+    def get_soup(self, url: str, parse_only=None, cached=False):
+        """Returns the bs4.BeautifulSoup object.
+
+        Only the parts of the page matched by parse_only (a bs4.SoupStrainer) are
+        parsed if given. With cached=True the page is kept among the recently fetched
+        pages (used by crawl for the search pages).
+        """
+        # build a new soup every time (soups are mutable) from the (cached) page bytes
+        content, encoding = self._fetch_page(url) if cached else self._get_page(url)
+        return BeautifulSoup(content, _PARSER, parse_only=parse_only, from_encoding=encoding)
+
+    def _get_page(self, url: str) -> Tuple[bytes, Optional[str]]:
+        """Returns the page content and its encoding (None if the server didn't send it).
+
+        Raises requests.HTTPError for an error status (e.g. 404 for a removed restaurant),
+        so that error pages are not parsed. A cached 404 stays in the on-disk cache.
+        """
+        page = self._session.get(url, timeout=10)
+        page.raise_for_status()
+        # only trust an explicit charset, requests otherwise assumes ISO-8859-1 for text/html. Without
+        # one the parser detects the encoding itself from the (already decompressed) bytes
+        encoding = page.encoding if 'charset' in page.headers.get('Content-Type', '') else None
+        return page.content, encoding
+
+    def _uncache_page(self, url: str):
+        """Removes the page from the on-disk cache (if caching with cache_name)."""
+        cache = getattr(self._session, 'cache', None)
+        if cache is None:
+            return
+        if hasattr(cache, 'delete'):
+            cache.delete(urls=[url])
+        else:
+            cache.delete_url(url)  # requests_cache < 1.0
 
     @staticmethod
     def _webdriversession(mode='create', wbdriver=None):
@@ -482,13 +744,24 @@ class Scraper:
             raise ValueError(f"mode='{mode}' is invalid. Valid values are ['create', 'close']")
         try:
             if mode == 'create':
-                session = webdriver.Safari()  # can use Chrome() or Firefox() as alternatives
+                # headless Chrome without images: no browser window to draw and fewer bytes to load.
+                # Can use Safari() or Firefox() as alternatives
+                options = webdriver.ChromeOptions()
+                options.add_argument('--headless=new')
+                options.add_argument('--disable-gpu')
+                options.add_argument('--blink-settings=imagesEnabled=false')
+                options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+                session = webdriver.Chrome(options=options)
+                session.set_page_load_timeout(15)  # seconds
+                # don't download the media, fonts, ads and trackers (the page scripts are needed for the pop up)
+                session.execute_cdp_cmd('Network.enable', {})
+                session.execute_cdp_cmd('Network.setBlockedURLs', {'urls': _BLOCKED_URLS})
                 return session
             elif mode == 'close':
-                wbdriver.close()
-                print('Web driver session closed.')
+                wbdriver.quit()  # also ends the browser process
+                log.debug('[_webdriversession] Web driver session closed.')
         except (NameError, AttributeError, SessionNotCreatedException) as e:
-            print(f'[_webdriversession] An exception has been thrown: {repr(e)}\n')
+            log.warning('[_webdriversession] An exception has been thrown: %r', e)
         return
 
 
@@ -1,19 +1,25 @@
 import pyproj
-from typing import Tuple
+from functools import lru_cache
+from typing import Iterator, Tuple
 import numpy as np
-import numpy.matlib
 
 
-def lonlat_to_xy(Lon:float, Lat:float, inverse=False, zone=33) -> Tuple:
+_GEOD = pyproj.Geod(ellps='WGS84')
+
+
+def lonlat_to_xy(Lon, Lat, inverse=False, zone=33) -> Tuple:
     """Transforms latitude and longitude to UTM coordinates.
+
+    Pass arrays rather than calling it in a loop: all the points are then
+    transformed in a single call.
     
     Arguments:
     ----------
-    Lon: float,
-        Longitude value if inverse=False, otherwise x value.
+    Lon: float or array_like,
+        Longitude value(s) if inverse=False, otherwise x value(s).
     
-    Lat: float,
-        Latitude value if inverse=False, otherwise y value.
+    Lat: float or array_like,
+        Latitude value(s) if inverse=False, otherwise y value(s).
     
     inverse: bool,
         False if converting from lat, long to x, y otherwise set to True.
@@ -27,8 +33,13 @@ def lonlat_to_xy(Lon:float, Lat:float, inverse=False, zone=33) -> Tuple:
     The transformed coordinates (latitude, longitude) or (eastings, northings)
     with units are degrees and meters respectively.
     """
-    P = pyproj.Proj(proj='utm', zone=zone, ellps='WGS84', preserve_units=True)
-    return P(Lon, Lat, inverse=inverse)
+    return _get_proj(zone)(Lon, Lat, inverse=inverse)
+
+
+@lru_cache(maxsize=32)
+def _get_proj(zone: int):
+    """Returns the (reusable) UTM projection of the zone."""
+    return pyproj.Proj(proj='utm', zone=zone, ellps='WGS84', preserve_units=True)
 
 
 def create_grid(centre:Tuple[float, float], length:int, minor_radius:int, area_shape:str, ov=True):
@@ -68,6 +79,48 @@ def create_grid(centre:Tuple[float, float], length:int, minor_radius:int, area_s
     -----
     * Create grid for other shapes besides circles.
     """
+    grid_centres, area_radius = _grid_axes(centre, length, minor_radius, ov)
+
+    # repeat each axis to a square array (every row is the same)
+    num = grid_centres.shape[1]
+    centres_x, centres_y = np.repeat(grid_centres[:, np.newaxis, :], num, axis=1)
+
+    return centres_x, centres_y, area_radius
+
+
+def create_grid_iter(centre:Tuple[float, float], length:int, minor_radius:int, area_shape:str, ov=True,
+                     tile=4096) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yields the grid centres of create_grid in tiles of at most tile points.
+
+    Every x grid value is paired with every y grid value, i.e. the points
+    (centres_x.T.flatten(), centres_y.flatten()) of create_grid, in that order.
+    The full grid arrays are never built, so each tile can be processed
+    (e.g. converted with lonlat_to_xy) while it is small.
+
+    Arguments:
+    ----------
+    See create_grid.
+
+    tile: int, (optional; default=4096)
+        The maximum number of grid centres per tile.
+
+    Yields:
+    -------
+    xs: numpy.ndarray,
+        The x coordinates of the grid centres in the tile (1-D).
+
+    ys: numpy.ndarray,
+        The y coordinates of the grid centres in the tile (1-D).
+    """
+    (grid_x, grid_y), _ = _grid_axes(centre, length, minor_radius, ov)
+    num = grid_x.shape[0]
+    for start in range(0, num * num, tile):
+        k = np.arange(start, min(start + tile, num * num))
+        yield grid_x[k // num], grid_y[k % num]
+
+
+def _grid_axes(centre, length, minor_radius, ov) -> Tuple[np.ndarray, float]:
+    """Returns the grid values of each axis (row 0: x, row 1: y) and the area radius."""
     # calculate the minimum value needed to make the grid shapes overlap
     if ov:
         ov_amount = minor_radius * (2 ** 0.5) - minor_radius
@@ -84,30 +137,28 @@ def create_grid(centre:Tuple[float, float], length:int, minor_radius:int, area_s
     # compute the new circle radius
     area_radius = minor_radius - ov_amount
 
-    # create the grid
-    grid_centres_x, grid_centres_y = [], []
-    for i, val in enumerate(centre):
-        start = val - length + minor_radius
-        stop = val + length - minor_radius
-        grid_centres = np.linspace(start, stop, int(num_grid_areas))
-        # broadcast to a square array
-        if i==0:
-            centres_x = np.matlib.repmat(grid_centres, np.max(grid_centres.shape), 1)
-        elif i==1:
-            centres_y = np.matlib.repmat(grid_centres, np.max(grid_centres.shape), 1)
-        else:
-            raise ValueError(f"Number of elements in centre should be 2. Got {len(centre)} instead")
+    if len(centre) != 2:
+        raise ValueError(f"Number of elements in centre should be 2. Got {len(centre)} instead")
 
-    return centres_x, centres_y, area_radius
+    # create the grid: both axes at once (row 0: x, row 1: y)
+    c = np.asarray(centre, dtype=np.float64)
+    grid_centres = np.linspace(c - length + minor_radius, c + length - minor_radius, int(num_grid_areas), axis=1)
+
+    return grid_centres, area_radius
 
 
 def compute_xy_distance(Lat1, Lon1, Lat2, Lon2):
-    G = pyproj.Geod(ellps='WGS84')
-    return G.inv(Lon1, Lat1, Lon2, Lat2)[2]
+    """Returns the geodesic distance(s) in meters between (Lat1, Lon1) and (Lat2, Lon2).
+
+    The inputs can be floats or arrays of the same shape (computed in a single call).
+    """
+    return _GEOD.inv(Lon1, Lat1, Lon2, Lat2)[2]
 
 
 def calc_xy_distance(x1, y1, x2, y2):
-    dx = x2 - x1
-    dy = y2 - y1
-    return (dx*dx + dy*dy) ** 0.5
+    """Returns the euclidean distance(s) between (x1, y1) and (x2, y2).
+
+    The inputs can be floats or numpy arrays (broadcast against each other).
+    """
+    return np.hypot(x2 - x1, y2 - y1)
 